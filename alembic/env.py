@@ -6,8 +6,10 @@ from sqlalchemy.engine import Connection
 from sqlalchemy.ext.asyncio import async_engine_from_config
 
 from alembic import context
-from app.config import settings 
-from app.models import Base
+from sqlmodel import SQLModel
+
+from app.config import settings
+import app.models  # noqa: F401
 
 # this is the Alembic Config object, which provides
 # access to the values within the .ini file in use.
@@ -25,13 +27,22 @@ if config.config_file_name is not None:
 # from myapp import mymodel
 # target_metadata = mymodel.Base.metadata
 
-target_metadata = Base.metadata 
+target_metadata = SQLModel.metadata
 
 # other values from the config, defined by the needs of env.py,
 # can be acquired:
 # my_important_option = config.get_main_option("my_important_option")
 # ... etc.
 
+# Guards for running against a live database, overridable per run with
+# ``alembic -x lock_timeout=10s -x statement_timeout=0 upgrade head``.
+lock_timeout = context.get_x_argument(as_dictionary=True).get(
+    "lock_timeout", settings.MIGRATION_LOCK_TIMEOUT
+)
+statement_timeout = context.get_x_argument(as_dictionary=True).get(
+    "statement_timeout", settings.MIGRATION_STATEMENT_TIMEOUT
+)
+
 
 def run_migrations_offline() -> None:
     """Run migrations in 'offline' mode.
@@ -51,6 +62,7 @@ def run_migrations_offline() -> None:
         target_metadata=target_metadata,
         literal_binds=True,
         dialect_opts={"paramstyle": "named"},
+        transaction_per_migration=True,
     )
 
     with context.begin_transaction():
@@ -58,7 +70,19 @@ def run_migrations_offline() -> None:
 
 
 def do_run_migrations(connection: Connection) -> None:
-    context.configure(connection=connection, target_metadata=target_metadata)
+    # Session-level, so the settings also hold inside autocommit blocks
+    # (see app.migrate).
+    connection.exec_driver_sql(f"SET lock_timeout = '{lock_timeout}'")
+    connection.exec_driver_sql(f"SET statement_timeout = '{statement_timeout}'")
+    connection.commit()
+
+    context.configure(
+        connection=connection,
+        target_metadata=target_metadata,
+        # Keeps the commit done by an autocommit block (CREATE INDEX
+        # CONCURRENTLY, batched backfills) scoped to a single revision.
+        transaction_per_migration=True,
+    )
 
     with context.begin_transaction():
         context.run_migrations()
@@ -0,0 +1,55 @@
+"""Concurrent indexes
+
+Revision ID: d8e2b47a1f63
+Revises: c3f1a9d27e54
+Create Date: 2026-10-19 19:41:37.602918
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+from app.migrate import create_index_concurrently, drop_index_concurrently
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd8e2b47a1f63'
+down_revision: Union[str, Sequence[str], None] = 'c3f1a9d27e54'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    create_index_concurrently(op.f('ix_authors_id'), 'authors', ['id'])
+    create_index_concurrently(op.f('ix_authors_name'), 'authors', ['name'])
+    create_index_concurrently(op.f('ix_authors_short'), 'authors', ['short'])
+    create_index_concurrently(op.f('ix_sources_id'), 'sources', ['id'])
+    create_index_concurrently(op.f('ix_sources_name'), 'sources', ['name'])
+    create_index_concurrently(op.f('ix_titles_id'), 'titles', ['id'])
+    create_index_concurrently(op.f('ix_titles_name'), 'titles', ['name'])
+    create_index_concurrently(op.f('ix_titles_code'), 'titles', ['code'])
+    create_index_concurrently(op.f('ix_titles_author_id'), 'titles', ['author_id'])
+    create_index_concurrently(op.f('ix_titleplates_id'), 'titleplates', ['id'])
+    create_index_concurrently(op.f('ix_titleplates_title_id'), 'titleplates', ['title_id'])
+    create_index_concurrently(op.f('ix_files_id'), 'files', ['id'])
+    create_index_concurrently(op.f('ix_files_title_id'), 'files', ['title_id'])
+    create_index_concurrently(op.f('ix_files_source_id'), 'files', ['source_id'])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    drop_index_concurrently(op.f('ix_files_source_id'), 'files')
+    drop_index_concurrently(op.f('ix_files_title_id'), 'files')
+    drop_index_concurrently(op.f('ix_files_id'), 'files')
+    drop_index_concurrently(op.f('ix_titleplates_title_id'), 'titleplates')
+    drop_index_concurrently(op.f('ix_titleplates_id'), 'titleplates')
+    drop_index_concurrently(op.f('ix_titles_author_id'), 'titles')
+    drop_index_concurrently(op.f('ix_titles_code'), 'titles')
+    drop_index_concurrently(op.f('ix_titles_name'), 'titles')
+    drop_index_concurrently(op.f('ix_titles_id'), 'titles')
+    drop_index_concurrently(op.f('ix_sources_name'), 'sources')
+    drop_index_concurrently(op.f('ix_sources_id'), 'sources')
+    drop_index_concurrently(op.f('ix_authors_short'), 'authors')
+    drop_index_concurrently(op.f('ix_authors_name'), 'authors')
+    drop_index_concurrently(op.f('ix_authors_id'), 'authors')
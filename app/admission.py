@@ -0,0 +1,309 @@
+"""Admission control for uploads and page reads.
+
+Requests are split into classes with their own limits, so a burst of
+large attachment uploads cannot take the slots, or the bandwidth, that
+browsing users need, and a catalogue page's images do not compete with
+the pages themselves:
+
+- ``upload``: POST/PUT/PATCH with a body of at least ``UPLOAD_MIN_SIZE``
+  bytes, or of unknown length;
+- ``media``: ``/images/`` and ``/plates/``;
+- ``page``: everything else.
+
+Each class admits at most ``*_CONCURRENCY`` requests at once and at most
+``*_CONCURRENCY_PER_CLIENT`` from one client. Requests over either limit
+wait, for up to ``*_QUEUE_TIMEOUT`` seconds, in a queue of ``*_QUEUE_SIZE``
+overall and ``*_QUEUE_PER_CLIENT`` per client. A full overall queue or a
+timeout is answered with ``503``, a full queue of the client with ``429``;
+both carry ``Retry-After``. Request bodies of uploads and response bodies
+of the other classes are paced to ``*_BANDWIDTH`` bytes per second overall
+and ``*_BANDWIDTH_PER_CLIENT`` per client (0 means unlimited).
+
+Like the connection pool, the limits apply per worker process, except
+``UPLOAD_CONCURRENCY``, which holds for the whole host: uploads are
+spooled to local temp files, and a per-process limit would let ``WORKERS``
+times as many of them fill the disk. The workers share it through
+``HostSlots`` in ``ADMISSION_LOCK_PATH``; the upload queues and
+per-client limits stay per process.
+"""
+
+import asyncio
+import fcntl
+import math
+import os
+import time
+
+from starlette.responses import JSONResponse
+
+from app.config import settings
+
+BODY_METHODS = {"POST", "PUT", "PATCH"}
+EXEMPT_PREFIXES = ("/static/",)
+MEDIA_PREFIXES = ("/images/", "/plates/")
+
+
+class Rejected(Exception):
+    def __init__(self, status_code: int, detail: str, retry_after: float):
+        self.status_code = status_code
+        self.detail = detail
+        self.retry_after = retry_after
+
+    def response(self) -> JSONResponse:
+        return JSONResponse(
+            {"detail": self.detail},
+            status_code=self.status_code,
+            headers={"Retry-After": str(max(1, math.ceil(self.retry_after)))},
+        )
+
+
+class TokenBucket:
+    """Pace a byte stream to ``rate`` bytes per second with one second of burst.
+
+    Consumers may run the bucket into debt and then sleep it off, so a large
+    chunk is never split and concurrent consumers queue up fairly.
+    """
+
+    def __init__(self, rate: int):
+        self.rate = rate
+        self.tokens = float(rate)
+        self.updated = time.monotonic()
+
+    async def consume(self, size: int) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= size
+        if self.tokens < 0:
+            await asyncio.sleep(-self.tokens / self.rate)
+
+
+class HostSlots:
+    """``count`` slots shared by every worker on the host.
+
+    Slot ``i`` is held by whoever has ``flock()``ed ``<name>.<i>.lock`` in
+    ``path``. The kernel drops the lock with the process, so a worker that
+    is killed mid-request cannot leak its slot. Workers poll for a free
+    slot, so they are admitted in no particular order.
+    """
+
+    POLL_SECONDS = 0.05
+
+    def __init__(self, path: str, name: str, count: int):
+        self.files = [os.path.join(path, f"{name}.{i}.lock") for i in range(count)]
+
+    def try_acquire(self) -> int | None:
+        if self.files:
+            os.makedirs(os.path.dirname(self.files[0]), exist_ok=True)
+        for file in self.files:
+            # A fresh descriptor per attempt: locks on descriptors inherited
+            # from the gunicorn master would be shared by all its workers.
+            fd = os.open(file, os.O_RDWR | os.O_CREAT, 0o600)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                os.close(fd)
+                continue
+            except BaseException:
+                os.close(fd)
+                raise
+            return fd
+        return None
+
+    async def acquire(self) -> int:
+        while (fd := self.try_acquire()) is None:
+            await asyncio.sleep(self.POLL_SECONDS)
+        return fd
+
+    @staticmethod
+    def release(fd: int) -> None:
+        os.close(fd)
+
+
+class Client:
+    """One client's share of a ``Limiter``."""
+
+    def __init__(self, concurrency: int):
+        self.slots = asyncio.Semaphore(concurrency)
+        self.requests = 0
+        self.bucket: TokenBucket | None = None
+
+
+class Limiter:
+    """Concurrency, queueing and bandwidth limits of one request class."""
+
+    def __init__(
+        self,
+        name: str,
+        concurrency: int,
+        concurrency_per_client: int,
+        queue_size: int,
+        queue_per_client: int,
+        queue_timeout: float,
+        bandwidth: int = 0,
+        bandwidth_per_client: int = 0,
+        host_slots: HostSlots | None = None,
+    ):
+        self.name = name
+        self.concurrency_per_client = concurrency_per_client
+        self.queue_size = queue_size
+        self.queue_per_client = queue_per_client
+        self.queue_timeout = queue_timeout
+        self.bandwidth_per_client = bandwidth_per_client
+        self._slots = asyncio.Semaphore(concurrency)
+        self._waiting = 0
+        self._clients: dict[str, Client] = {}
+        self._bucket = TokenBucket(bandwidth) if bandwidth else None
+        self._host_slots = host_slots
+
+    async def acquire(self, client: str) -> int | None:
+        """Wait for a slot; returns the host slot to pass back to ``release``."""
+        state = self._clients.get(client)
+        requests = state.requests if state is not None else 0
+        if requests >= self.concurrency_per_client + self.queue_per_client:
+            raise Rejected(
+                429, f"Too many {self.name} requests from this client", self.queue_timeout
+            )
+        if self._slots.locked() and self._waiting >= self.queue_size:
+            raise Rejected(503, f"Too many {self.name} requests queued", self.queue_timeout)
+        if state is None:
+            state = self._clients[client] = Client(self.concurrency_per_client)
+        state.requests += 1
+        self._waiting += 1
+        try:
+            return await asyncio.wait_for(self._wait(state), self.queue_timeout)
+        except asyncio.TimeoutError:
+            self._leave(client)
+            raise Rejected(
+                503, f"Timed out waiting for a {self.name} slot", self.queue_timeout
+            ) from None
+        except BaseException:
+            self._leave(client)
+            raise
+        finally:
+            self._waiting -= 1
+
+    async def _wait(self, state: Client) -> int | None:
+        # The client's own slot first, so one client's backlog never holds
+        # overall slots it cannot use yet.
+        await state.slots.acquire()
+        try:
+            await self._slots.acquire()
+        except BaseException:
+            state.slots.release()
+            raise
+        if self._host_slots is None:
+            return None
+        try:
+            return await self._host_slots.acquire()
+        except BaseException:
+            self._slots.release()
+            state.slots.release()
+            raise
+
+    def release(self, client: str, host_slot: int | None = None) -> None:
+        if host_slot is not None:
+            self._host_slots.release(host_slot)
+        self._slots.release()
+        self._clients[client].slots.release()
+        self._leave(client)
+
+    def _leave(self, client: str) -> None:
+        state = self._clients[client]
+        state.requests -= 1
+        if not state.requests:
+            del self._clients[client]
+
+    async def throttle(self, client: str, size: int) -> None:
+        if self.bandwidth_per_client:
+            state = self._clients[client]
+            if state.bucket is None:
+                state.bucket = TokenBucket(self.bandwidth_per_client)
+            await state.bucket.consume(size)
+        if self._bucket is not None:
+            await self._bucket.consume(size)
+
+
+uploads = Limiter(
+    "upload",
+    settings.UPLOAD_CONCURRENCY,
+    settings.UPLOAD_CONCURRENCY_PER_CLIENT,
+    settings.UPLOAD_QUEUE_SIZE,
+    settings.UPLOAD_QUEUE_PER_CLIENT,
+    settings.UPLOAD_QUEUE_TIMEOUT,
+    settings.UPLOAD_BANDWIDTH,
+    settings.UPLOAD_BANDWIDTH_PER_CLIENT,
+    HostSlots(settings.ADMISSION_LOCK_PATH, "upload", settings.UPLOAD_CONCURRENCY),
+)
+pages = Limiter(
+    "page",
+    settings.PAGE_CONCURRENCY,
+    settings.PAGE_CONCURRENCY_PER_CLIENT,
+    settings.PAGE_QUEUE_SIZE,
+    settings.PAGE_QUEUE_PER_CLIENT,
+    settings.PAGE_QUEUE_TIMEOUT,
+    settings.PAGE_BANDWIDTH,
+    settings.PAGE_BANDWIDTH_PER_CLIENT,
+)
+media = Limiter(
+    "media",
+    settings.MEDIA_CONCURRENCY,
+    settings.MEDIA_CONCURRENCY_PER_CLIENT,
+    settings.MEDIA_QUEUE_SIZE,
+    settings.MEDIA_QUEUE_PER_CLIENT,
+    settings.MEDIA_QUEUE_TIMEOUT,
+    settings.MEDIA_BANDWIDTH,
+    settings.MEDIA_BANDWIDTH_PER_CLIENT,
+)
+
+
+def is_upload(method: str, headers: dict[bytes, bytes]) -> bool:
+    if method not in BODY_METHODS:
+        return False
+    length = headers.get(b"content-length")
+    if length is None:
+        return b"chunked" in headers.get(b"transfer-encoding", b"")
+    try:
+        return int(length) >= settings.UPLOAD_MIN_SIZE
+    except ValueError:
+        return False
+
+
+class AdmissionMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"].startswith(EXEMPT_PREFIXES):
+            return await self.app(scope, receive, send)
+
+        client = scope["client"][0] if scope.get("client") else ""
+        upload = is_upload(scope["method"], dict(scope["headers"]))
+        if upload:
+            limiter = uploads
+        elif scope["path"].startswith(MEDIA_PREFIXES):
+            limiter = media
+        else:
+            limiter = pages
+        try:
+            host_slot = await limiter.acquire(client)
+        except Rejected as exc:
+            return await exc.response()(scope, receive, send)
+
+        async def receive_throttled():
+            message = await receive()
+            if message["type"] == "http.request" and message.get("body"):
+                await limiter.throttle(client, len(message["body"]))
+            return message
+
+        async def send_throttled(message):
+            if message["type"] == "http.response.body" and message.get("body"):
+                await limiter.throttle(client, len(message["body"]))
+            await send(message)
+
+        try:
+            if upload:
+                await self.app(scope, receive_throttled, send)
+            else:
+                await self.app(scope, receive, send_throttled)
+        finally:
+            limiter.release(client, host_slot)
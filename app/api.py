@@ -0,0 +1,254 @@
+"""Read API for nested title graphs.
+
+The client picks columns and relationships with ``fields``, nesting with
+parentheses::
+
+    GET /api/v1/titles?fields=name,year,author(name),plates(plate),files(url,source(name))
+
+Relationships are resolved level by level through request-scoped
+``Loader``s: every lookup of a table by the same column across all rows of
+a level becomes one ``IN (...)`` query, and rows already fetched during the
+request are served from the loader's cache. A page of titles with full
+nesting costs one query per relationship in ``fields``, whatever its size.
+
+Without ``fields`` titles come back as ``TitleOut`` and files as
+``FileOut``, encoded through ``app.serializers`` and its row cache.
+"""
+
+from typing import Any
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi_async_sqlalchemy import db
+from sqlalchemy import inspect, select
+
+from app.config import settings
+from app.models import Author, File, FileOut, Source, Title, TitleOut, TitlePlate
+from app.serializers import JSONResponse, RowEncoder, encode_rows, file_info
+
+router = APIRouter(prefix=settings.API_V1_STR)
+
+MODELS = (Author, Title, TitlePlate, File, Source)
+
+
+def relationships(model) -> dict[str, tuple]:
+    """name -> (target model, local column, remote column, many)"""
+    return {
+        rel.key: (rel.mapper.class_, local.key, remote.key, rel.uselist)
+        for rel in inspect(model).relationships
+        for local, remote in rel.local_remote_pairs[:1]
+    }
+
+
+RELATIONSHIPS = {model: relationships(model) for model in MODELS}
+
+# Stored sqlalchemy_file values are projected onto FileInfo/ImageInfo in
+# every response shape.
+CONVERTERS = {Title: {"logo": file_info}, File: {"file": file_info}}
+
+TITLE_OUT = RowEncoder(Title, TitleOut, CONVERTERS[Title])
+FILE_OUT = RowEncoder(File, FileOut, CONVERTERS[File])
+
+SELECTED = (
+    "Without ``fields``, TitleOut. With ``fields``, an object of the selected "
+    "columns and relationships, nested as in the selection, plus ``id``."
+)
+
+
+def parse_fields(spec: str) -> dict:
+    """Parse ``a,b(c,d(e))`` into ``{"a": None, "b": {"c": None, "d": {"e": None}}}``."""
+    stack = [{}]
+    name = ""
+    for char in spec + ",":
+        if char in ",()":
+            name = name.strip()
+            if char == "(":
+                if not name:
+                    raise ValueError("Expected a relationship name before '('")
+                stack[-1][name] = {}
+                stack.append(stack[-1][name])
+            elif name:
+                stack[-1][name] = None
+            if char == ")":
+                if len(stack) == 1:
+                    raise ValueError("Unbalanced ')'")
+                stack.pop()
+            name = ""
+        else:
+            name += char
+    if len(stack) != 1:
+        raise ValueError("Unbalanced '('")
+    return stack[0]
+
+
+def columns_for(model, selection: dict) -> tuple[list[str], dict]:
+    """Split a selection into requested columns and relationships."""
+    table = model.__table__
+    relations = RELATIONSHIPS[model]
+    columns, nested = [], {}
+    for name, sub in selection.items():
+        if name in relations:
+            nested[name] = sub or {}
+        elif name in table.c and sub is None:
+            columns.append(name)
+        else:
+            raise HTTPException(
+                status_code=400, detail=f"Unknown field {name!r} on {table.name}"
+            )
+    if not columns:
+        columns = [c.key for c in table.c if c.key not in ("created_at", "updated_at")]
+    return columns, nested
+
+
+class Loader:
+    """Batch and cache lookups of ``model`` rows by one column."""
+
+    def __init__(self, session, model, key: str, columns: tuple[str, ...]):
+        self.session = session
+        self.table = model.__table__
+        self.key = key
+        self.columns = columns
+        self.cache: dict = {}
+
+    async def load(self, keys) -> dict:
+        missing = {k for k in keys if k is not None and k not in self.cache}
+        if missing:
+            key_column = self.table.c[self.key]
+            result = await self.session.execute(
+                select(*(self.table.c[name] for name in self.columns))
+                .where(key_column.in_(missing))
+                .order_by(self.table.c.id)
+            )
+            for k in missing:
+                self.cache[k] = []
+            for row in result.mappings():
+                self.cache[row[self.key]].append(dict(row))
+        return {k: self.cache.get(k, []) for k in keys}
+
+
+class Loaders:
+    """All loaders of one request."""
+
+    def __init__(self, session):
+        self.session = session
+        self._loaders: dict[tuple, Loader] = {}
+
+    def get(self, model, key: str, columns: tuple[str, ...]) -> Loader:
+        loader = self._loaders.get((model, key, columns))
+        if loader is None:
+            loader = Loader(self.session, model, key, columns)
+            self._loaders[(model, key, columns)] = loader
+        return loader
+
+
+def get_loaders() -> Loaders:
+    return Loaders(db.session)
+
+
+def query_columns(model, columns: list[str], nested: dict, *extra: str) -> tuple[str, ...]:
+    """Requested columns plus the ones needed to join the nested levels."""
+    needed = {"id", *columns, *extra}
+    for name in nested:
+        needed.add(RELATIONSHIPS[model][name][1])
+    return tuple(sorted(needed))
+
+
+async def resolve(loaders: Loaders, model, rows: list[dict], columns, nested: dict) -> list[dict]:
+    for name, selection in nested.items():
+        target, local, remote, many = RELATIONSHIPS[model][name]
+        child_columns, child_nested = columns_for(target, selection)
+        loader = loaders.get(
+            target, remote, query_columns(target, child_columns, child_nested, remote)
+        )
+        found = await loader.load({row[local] for row in rows})
+
+        # Rows may be shared through the cache, so each parent gets copies
+        # trimmed to the selection.
+        children = {key: [dict(child) for child in value] for key, value in found.items()}
+        all_children = [child for value in children.values() for child in value]
+        await resolve(loaders, target, all_children, child_columns, child_nested)
+        for row in rows:
+            value = children.get(row[local], [])
+            row[name] = value if many else (value[0] if value else None)
+    keep = {"id", *columns, *nested}
+    converters = [
+        (name, convert) for name, convert in CONVERTERS.get(model, {}).items() if name in columns
+    ]
+    for row in rows:
+        for key in list(row):
+            if key not in keep:
+                del row[key]
+        for name, convert in converters:
+            row[name] = convert(row[name])
+    return rows
+
+
+def title_query(fields: str, *where):
+    try:
+        selection = parse_fields(fields)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    columns, nested = columns_for(Title, selection)
+    table = Title.__table__
+    statement = select(*(table.c[name] for name in query_columns(Title, columns, nested)))
+    return columns, nested, statement.where(*where)
+
+
+def page(table, after: int | None, ids: list[int] | None = None) -> list:
+    where = []
+    if ids:
+        where.append(table.c.id.in_(ids))
+    if after is not None:
+        where.append(table.c.id > after)
+    return where
+
+
+@router.get(
+    "/titles",
+    responses={200: {"model": list[TitleOut] | list[dict[str, Any]], "description": SELECTED}},
+)
+async def list_titles(
+    fields: str = "",
+    ids: list[int] | None = Query(None),
+    after: int | None = None,
+    limit: int = Query(50, gt=0, le=500),
+    loaders: Loaders = Depends(get_loaders),
+):
+    table = Title.__table__
+    where = page(table, after, ids)
+    if not fields:
+        return JSONResponse(await encode_rows(loaders.session, TITLE_OUT, where, limit))
+    columns, nested, statement = title_query(fields, *where)
+    result = await loaders.session.execute(statement.order_by(table.c.id).limit(limit))
+    rows = [dict(row) for row in result.mappings()]
+    return JSONResponse(await resolve(loaders, Title, rows, columns, nested))
+
+
+@router.get(
+    "/titles/{title_id}",
+    responses={200: {"model": TitleOut | dict[str, Any], "description": SELECTED}},
+)
+async def get_title(title_id: int, fields: str = "", loaders: Loaders = Depends(get_loaders)):
+    where = Title.__table__.c.id == title_id
+    if not fields:
+        content = await encode_rows(loaders.session, TITLE_OUT, [where])
+        if content == b"[]":
+            raise HTTPException(status_code=404, detail="Title not found")
+        return JSONResponse(content[1:-1])
+    columns, nested, statement = title_query(fields, where)
+    row = (await loaders.session.execute(statement)).mappings().first()
+    if row is None:
+        raise HTTPException(status_code=404, detail="Title not found")
+    return JSONResponse((await resolve(loaders, Title, [dict(row)], columns, nested))[0])
+
+
+@router.get("/files", response_model=list[FileOut])
+async def list_files(
+    title_id: int | None = None,
+    after: int | None = None,
+    limit: int = Query(50, gt=0, le=500),
+):
+    table = File.__table__
+    where = page(table, after)
+    if title_id is not None:
+        where.append(table.c.title_id == title_id)
+    return JSONResponse(await encode_rows(db.session, FILE_OUT, where, limit))
@@ -6,12 +6,26 @@ from sqlmodel.ext.asyncio.session import AsyncSession
 from sqlalchemy.pool import NullPool, AsyncAdaptedQueuePool
 
 
+# Sized per worker process: the server runs WORKERS of them, so the total is
+# WORKERS * (POOL_SIZE + MAX_OVERFLOW) connections.
+pool_args = (
+    {}
+    if settings.MODE == ModeEnum.testing
+    else {
+        "pool_size": settings.POOL_SIZE,
+        "max_overflow": settings.MAX_OVERFLOW,
+        "pool_pre_ping": True,
+        "pool_recycle": 3600,
+    }
+)
+
 engine = create_async_engine(
     str(settings.ASYNC_DATABASE_URI),
     echo=False,
     poolclass=NullPool
     if settings.MODE == ModeEnum.testing
     else AsyncAdaptedQueuePool,  # Asyncio pytest works with NullPool
+    **pool_args,
 )
 
 SessionLocal = sessionmaker(
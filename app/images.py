@@ -0,0 +1,322 @@
+import asyncio
+import hashlib
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import suppress
+from functools import lru_cache
+
+from fastapi import APIRouter, HTTPException, Query, Request
+from fastapi.responses import FileResponse
+from PIL import Image, UnidentifiedImageError
+
+from app import storage
+from app.config import settings
+
+router = APIRouter()
+
+MEDIA_TYPES = {
+    "avif": "image/avif",
+    "webp": "image/webp",
+    "jpeg": "image/jpeg",
+    "png": "image/png",
+}
+
+RESCAN_SECONDS = 60
+TOUCH_SECONDS = 300
+STALE_TMP_SECONDS = 3600
+
+IMAGE_CONTAINERS = ("logo",)
+PLATE_EXTENSIONS = {".png", ".jpg", ".jpeg", ".webp", ".tif", ".tiff"}
+# Raised by Pillow for files it cannot decode or that decode too large.
+IMAGE_ERRORS = (UnidentifiedImageError, Image.DecompressionBombError)
+
+SAVE_OPTIONS = {
+    "avif": {"quality": 60},
+    "webp": {"quality": 80, "method": 4},
+    "jpeg": {"quality": 82, "optimize": True, "progressive": True},
+    "png": {"optimize": True},
+}
+
+
+class VariantCache:
+    """Size-bounded LRU of rendered variants kept on local disk.
+
+    The directory is shared by all workers on the host. Each worker's
+    in-memory index is rebuilt from it every ``RESCAN_SECONDS`` and before
+    anything is evicted, so the size bound holds for the directory as a
+    whole. Recency is the file mtime, bumped on hits, so it is shared as
+    well. A file listed in the index may have been evicted by another
+    worker since; ``get()`` checks the disk and the variant is rendered
+    again.
+    """
+
+    def __init__(self, path: str, max_size: int):
+        self.path = path
+        self.max_size = max_size
+        self._entries: OrderedDict[str, int] = OrderedDict()
+        self._size = 0
+        self._scanned = 0.0
+        self._lock = threading.Lock()
+
+    def file_path(self, key: str, fmt: str) -> str:
+        return os.path.join(self.path, key[:2], f"{key}.{fmt}")
+
+    def scan(self) -> None:
+        found = []
+        now = time.time()
+        for folder, _, files in os.walk(self.path):
+            for name in files:
+                full_path = os.path.join(folder, name)
+                try:
+                    stat = os.stat(full_path)
+                except FileNotFoundError:
+                    continue
+                if name.endswith(".tmp"):
+                    # Left behind by a render that died; ones in progress,
+                    # possibly in another worker, are younger.
+                    if now - stat.st_mtime > STALE_TMP_SECONDS:
+                        with suppress(FileNotFoundError):
+                            os.unlink(full_path)
+                    continue
+                found.append((stat.st_mtime, full_path, stat.st_size))
+        entries = OrderedDict((full_path, size) for _, full_path, size in sorted(found))
+        with self._lock:
+            self._entries = entries
+            self._size = sum(entries.values())
+            self._scanned = time.monotonic()
+
+    def load(self) -> None:
+        self.scan()
+        self._evict()
+
+    def get(self, path: str) -> os.stat_result | None:
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            with self._lock:
+                self._size -= self._entries.pop(path, 0)
+            return None
+        if time.time() - stat.st_mtime > TOUCH_SECONDS:
+            with suppress(FileNotFoundError):
+                os.utime(path)
+        with self._lock:
+            if path in self._entries:
+                self._entries.move_to_end(path)
+            else:
+                # Rendered by another worker.
+                self._entries[path] = stat.st_size
+                self._size += stat.st_size
+        return stat
+
+    def put(self, path: str, size: int) -> None:
+        with self._lock:
+            self._size += size - self._entries.pop(path, 0)
+            self._entries[path] = size
+            rescan = time.monotonic() - self._scanned > RESCAN_SECONDS
+        if rescan:
+            self.scan()
+        self._evict()
+
+    def _evict(self) -> None:
+        with self._lock:
+            if self._size <= self.max_size:
+                return
+        # Count the other workers' files before deleting anything.
+        self.scan()
+        while True:
+            with self._lock:
+                if self._size <= self.max_size or len(self._entries) <= 1:
+                    return
+                path, size = self._entries.popitem(last=False)
+                self._size -= size
+            with suppress(FileNotFoundError):
+                os.unlink(path)
+
+
+cache = VariantCache(settings.IMAGE_CACHE_PATH, settings.IMAGE_CACHE_MAX_SIZE)
+
+_executor: ThreadPoolExecutor | None = None
+_pending: dict[str, asyncio.Future] = {}
+
+
+async def startup() -> None:
+    global _executor
+    os.makedirs(cache.path, exist_ok=True)
+    _executor = ThreadPoolExecutor(
+        max_workers=settings.IMAGE_WORKERS, thread_name_prefix="images"
+    )
+    await asyncio.get_running_loop().run_in_executor(_executor, cache.load)
+
+
+async def shutdown() -> None:
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=True, cancel_futures=True)
+        _executor = None
+
+
+def supported_formats() -> set[str]:
+    Image.init()
+    return {fmt for fmt in MEDIA_TYPES if fmt.upper() in Image.SAVE}
+
+
+def accepted_types(accept: str) -> set[str]:
+    accepted = set()
+    for part in accept.split(","):
+        media_type, *params = (item.strip() for item in part.split(";"))
+        q = 1.0
+        for param in params:
+            if param.startswith("q="):
+                try:
+                    q = float(param[2:])
+                except ValueError:
+                    q = 0.0
+        if media_type and q > 0:
+            accepted.add(media_type.lower())
+    return accepted
+
+
+def negotiate(accept: str, original: str) -> str:
+    """Pick the most compact format the client accepts."""
+    accepted = accepted_types(accept)
+    supported = supported_formats()
+    for fmt in ("avif", "webp"):
+        if fmt in supported and MEDIA_TYPES[fmt] in accepted:
+            return fmt
+    return original
+
+
+def snap_width(width: int) -> int:
+    """Round a requested width up to the closest configured one.
+
+    Snapping keeps the number of variants per image small, so the cache
+    stays useful whatever viewport sizes the clients report.
+    """
+    widths = sorted(settings.IMAGE_WIDTHS)
+    for candidate in widths:
+        if candidate >= width:
+            return candidate
+    return widths[-1]
+
+
+def is_image_path(path: str) -> bool:
+    """Logos, or plate scans at the top of the store; never attachments."""
+    if path.endswith(storage.METADATA_SUFFIX):
+        return False
+    container, _, name = path.partition("/")
+    if name:
+        return container in IMAGE_CONTAINERS and "/" not in name
+    return os.path.splitext(path)[1].lower() in PLATE_EXTENSIONS
+
+
+def resolve(path: str) -> tuple[str, os.stat_result]:
+    if not is_image_path(path):
+        raise HTTPException(status_code=404, detail="Image not found")
+    root = os.path.realpath(settings.STORAGE_PATH)
+    full_path = os.path.realpath(storage.physical_path(root, path))
+    if os.path.commonpath([root, full_path]) != root or not os.path.isfile(full_path):
+        raise HTTPException(status_code=404, detail="Image not found")
+    return full_path, os.stat(full_path)
+
+
+def render(source: str, target: str, width: int | None, fmt: str) -> int:
+    with Image.open(source) as image:
+        if width is not None:
+            image.draft("RGB", (width, width * 4))
+            image.thumbnail((width, image.height), Image.Resampling.LANCZOS)
+        if fmt == "jpeg" and image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+        elif image.mode == "P":
+            image = image.convert("RGBA")
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        tmp = f"{target}.{uuid.uuid4().hex}.tmp"
+        try:
+            image.save(tmp, format=fmt.upper(), **SAVE_OPTIONS[fmt])
+            os.replace(tmp, target)
+        except BaseException:
+            with suppress(FileNotFoundError):
+                os.unlink(tmp)
+            raise
+    return os.path.getsize(target)
+
+
+def build(source: str, target: str, width: int | None, fmt: str) -> os.stat_result:
+    size = render(source, target, width, fmt)
+    # May rescan and evict, so it runs here rather than on the event loop.
+    cache.put(target, size)
+    return os.stat(target)
+
+
+@lru_cache(maxsize=10_000)
+def source_format(source: str, mtime_ns: int) -> str:
+    # Keyed by mtime as well, so a replaced file is looked at again.
+    with Image.open(source) as image:
+        fmt = (image.format or "png").lower()
+    return fmt if fmt in MEDIA_TYPES else "png"
+
+
+def inspect_source(path: str) -> tuple[str, os.stat_result, str]:
+    """Resolve ``path`` and detect its format, in one trip to the storage pool."""
+    source, stat = resolve(path)
+    return source, stat, source_format(source, stat.st_mtime_ns)
+
+
+async def get_variant(
+    source: str, stat: os.stat_result, width: int | None, fmt: str
+) -> tuple[str, os.stat_result]:
+    """Return the cached variant's path and stat, rendering it at most once at a time."""
+    key = hashlib.sha256(f"{source}:{stat.st_mtime_ns}:{width}:{fmt}".encode()).hexdigest()
+    target = cache.file_path(key, fmt)
+    cached = await storage.offload(cache.get, target)
+    if cached is not None:
+        return target, cached
+
+    future = _pending.get(key)
+    if future is None:
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(_executor, build, source, target, width, fmt)
+        _pending[key] = future
+        future.add_done_callback(lambda _: _pending.pop(key, None))
+    # Other requests may be waiting on the same future, so a client going
+    # away must not cancel the render.
+    return target, await asyncio.shield(future)
+
+
+@router.get("/images/{path:path}")
+async def image(
+    request: Request,
+    path: str,
+    w: int | None = Query(None, gt=0, le=4096),
+    fmt: str | None = Query(None, pattern="^(avif|webp|jpeg|png)$"),
+):
+    # Filesystem lookups go to the storage pool, which is sized for NFS
+    # latency; the render pool is kept for renders.
+    try:
+        source, stat, original = await storage.offload(inspect_source, path)
+    except IMAGE_ERRORS:
+        raise HTTPException(status_code=415, detail="Not a supported image")
+
+    headers = {"Cache-Control": "public, max-age=86400"}
+    if fmt is None:
+        fmt = negotiate(request.headers.get("accept", ""), original)
+        headers["Vary"] = "Accept"
+    elif fmt not in supported_formats():
+        raise HTTPException(status_code=400, detail=f"Format {fmt} is not supported")
+
+    width = snap_width(w) if w is not None else None
+    if width is None and fmt == original:
+        return FileResponse(
+            source, stat_result=stat, media_type=MEDIA_TYPES[fmt], headers=headers
+        )
+
+    try:
+        variant, variant_stat = await get_variant(source, stat, width, fmt)
+    except IMAGE_ERRORS:
+        raise HTTPException(status_code=415, detail="Not a supported image")
+    return FileResponse(
+        variant, stat_result=variant_stat, media_type=MEDIA_TYPES[fmt], headers=headers
+    )
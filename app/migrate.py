@@ -0,0 +1,193 @@
+"""Helpers for Alembic revisions that must run against a live database.
+
+Use them from ``upgrade()``/``downgrade()`` instead of the plain ``op``
+calls whenever the table is large enough that holding a lock on it for the
+length of the statement would stall the app::
+
+    from app.migrate import backfill, create_index_concurrently, lock_timeout
+
+    def upgrade() -> None:
+        with lock_timeout("2s"):
+            op.add_column("files", sa.Column("size", sa.BigInteger(), nullable=True))
+        create_index_concurrently("ix_files_size", "files", ["size"])
+        backfill("files_size", "files", "size = (file->>'size')::bigint", where="size IS NULL")
+
+``alembic/env.py`` runs each revision in its own transaction, so the
+autocommit blocks used here only commit the revision they belong to.
+"""
+
+import logging
+import time
+from contextlib import contextmanager
+
+from alembic import op
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
+
+logger = logging.getLogger("alembic.runtime.migration")
+
+LOCK_NOT_AVAILABLE = "55P03"
+
+
+def is_lock_timeout(exc: DBAPIError) -> bool:
+    orig = exc.orig
+    sqlstate = getattr(orig, "sqlstate", None) or getattr(orig, "pgcode", None)
+    return sqlstate == LOCK_NOT_AVAILABLE or "lock timeout" in str(orig)
+
+
+@contextmanager
+def lock_timeout(timeout: str = "5s"):
+    """Fail statements that wait longer than ``timeout`` for a lock.
+
+    DDL waiting on a lock also blocks every query queued behind it, so it
+    is better to fail fast and retry the migration than to wait.
+    """
+    previous = None
+    if not op.get_context().as_sql:
+        previous = op.get_bind().scalar(text("SHOW lock_timeout"))
+    op.execute(f"SET LOCAL lock_timeout = '{timeout}'")
+    try:
+        yield
+    finally:
+        if previous is None:
+            op.execute("SET LOCAL lock_timeout TO DEFAULT")
+        else:
+            op.execute(f"SET LOCAL lock_timeout = '{previous}'")
+
+
+@contextmanager
+def _no_lock_timeout():
+    """Lift the session's lock_timeout around a concurrent index build or drop.
+
+    ``CONCURRENTLY`` waits for every older transaction to finish through
+    their virtualxid locks, which ``lock_timeout`` applies to, so on a
+    live database any transaction open longer than the timeout would fail
+    the build and leave an invalid index. The SHARE UPDATE EXCLUSIVE lock
+    the build holds meanwhile does not block the app's reads or writes.
+    """
+    previous = None
+    if not op.get_context().as_sql:
+        previous = op.get_bind().scalar(text("SHOW lock_timeout"))
+    op.execute("SET lock_timeout = 0")
+    try:
+        yield
+    finally:
+        if previous is None:
+            op.execute("RESET lock_timeout")
+        else:
+            op.execute(f"SET lock_timeout = '{previous}'")
+
+
+def _index_is_valid(index_name: str) -> bool | None:
+    return op.get_bind().scalar(
+        text(
+            "SELECT i.indisvalid FROM pg_index i "
+            "JOIN pg_class c ON c.oid = i.indexrelid WHERE c.relname = :name"
+        ),
+        {"name": index_name},
+    )
+
+
+def create_index_concurrently(
+    index_name: str, table_name: str, columns: list[str], unique: bool = False, **kw
+) -> None:
+    """``CREATE INDEX CONCURRENTLY`` outside the revision's transaction.
+
+    A concurrent build that failed half way leaves an invalid index behind;
+    it is dropped and rebuilt so the revision can simply be re-run.
+    """
+    with op.get_context().autocommit_block(), _no_lock_timeout():
+        if not op.get_context().as_sql and _index_is_valid(index_name) is False:
+            op.drop_index(
+                index_name, table_name=table_name, postgresql_concurrently=True, if_exists=True
+            )
+        op.create_index(
+            index_name,
+            table_name,
+            columns,
+            unique=unique,
+            postgresql_concurrently=True,
+            if_not_exists=True,
+            **kw,
+        )
+
+
+def drop_index_concurrently(index_name: str, table_name: str) -> None:
+    with op.get_context().autocommit_block(), _no_lock_timeout():
+        op.drop_index(
+            index_name, table_name=table_name, postgresql_concurrently=True, if_exists=True
+        )
+
+
+def backfill(
+    name: str,
+    table_name: str,
+    set_: str,
+    where: str | None = None,
+    key: str = "id",
+    batch_size: int = 5000,
+    pause: float = 0.1,
+    retries: int = 10,
+    touch: bool = True,
+) -> None:
+    """Run ``UPDATE table SET ...`` in committed batches over ``key`` ranges.
+
+    Progress is recorded under ``name`` in ``alembic_backfill`` after every
+    batch, so an interrupted backfill resumes where it stopped; the record
+    is deleted once the backfill completes, so running it again (after a
+    downgrade, or from a later revision reusing ``name``) starts over. ``pause``
+    seconds between batches leave room for the app's own writes; a batch
+    that hits the lock timeout is retried up to ``retries`` times.
+
+    With ``touch`` the rows' ``updated_at`` is bumped too, which is what
+    tells the app's JSON row cache (``app.serializers``) to re-encode them;
+    pass ``touch=False`` only for tables without that column.
+    """
+    bind = op.get_bind()
+    condition = f" AND ({where})" if where else ""
+    if touch:
+        set_ = f"{set_}, updated_at = now()"
+    with op.get_context().autocommit_block():
+        bind.execute(
+            text(
+                "CREATE TABLE IF NOT EXISTS alembic_backfill "
+                "(name varchar PRIMARY KEY, last_key bigint NOT NULL, "
+                "updated_at timestamp NOT NULL DEFAULT now())"
+            )
+        )
+        start = bind.scalar(
+            text("SELECT last_key FROM alembic_backfill WHERE name = :name"), {"name": name}
+        )
+        low, high = bind.execute(text(f"SELECT min({key}), max({key}) FROM {table_name}")).one()
+        start = low if start is None else start + 1
+
+        while high is not None and start <= high:
+            end = start + batch_size
+            for attempt in range(retries + 1):
+                try:
+                    # One statement, so the batch and its progress row commit together.
+                    updated = bind.scalar(
+                        text(
+                            f"WITH updated AS (UPDATE {table_name} SET {set_} "
+                            f"WHERE {key} >= :start AND {key} < :end{condition} RETURNING 1), "
+                            "progress AS (INSERT INTO alembic_backfill (name, last_key) "
+                            "VALUES (:name, :last) ON CONFLICT (name) DO UPDATE "
+                            "SET last_key = excluded.last_key, updated_at = now()) "
+                            "SELECT count(*) FROM updated"
+                        ),
+                        {"start": start, "end": end, "name": name, "last": end - 1},
+                    )
+                    break
+                except DBAPIError as exc:
+                    if attempt == retries or not is_lock_timeout(exc):
+                        raise
+                    logger.warning("%s: lock timeout at %s=%d, retrying", name, key, start)
+                    time.sleep(pause * 2**attempt)
+            logger.info(
+                "%s: %s up to %d of %d, %d rows updated",
+                name, key, min(end - 1, high), high, updated,
+            )
+            start = end
+            time.sleep(pause)
+
+        bind.execute(text("DELETE FROM alembic_backfill WHERE name = :name"), {"name": name})
@@ -5,14 +5,12 @@ from datetime import datetime
 from pydantic import BaseModel
 
 # from libcloud.storage.drivers.local import LocalStorageDriver
-from libcloud.storage.providers import get_driver
 from libcloud.storage.types import (
     ContainerAlreadyExistsError,
     # ObjectDoesNotExistError,
-    Provider,
 )
 
-from sqlalchemy import func, Column
+from sqlalchemy import BigInteger, Text, func, Column
 from sqlalchemy.orm import declared_attr
 from sqlalchemy_file import File, FileField, ImageField
 # from sqlalchemy_file.exceptions import ValidationError
@@ -28,18 +26,20 @@ from sqlalchemy_file import File, FileField, ImageField
 
 from sqlmodel import SQLModel, Field, Relationship
 
+from app.config import settings
+from app.storage import AsyncLocalStorageDriver
 
 # storage = FileSystemStorage(path="/nfs/dvr/plates")
 
-os.makedirs("/nfs/dvr/plates/", 0o777, exist_ok=True)
-driver = get_driver(Provider.LOCAL)("/nfs/dvr/plates")
+os.makedirs(settings.STORAGE_PATH, 0o777, exist_ok=True)
+driver = AsyncLocalStorageDriver(settings.STORAGE_PATH)
 
-with contextlib.suppress(ContainerAlreadyExistsError):
-    for container_name in ("logo", "file"):
+for container_name in ("logo", "file"):
+    with contextlib.suppress(ContainerAlreadyExistsError):
         driver.create_container(container_name=container_name)
-        container = driver.get_container(container_name=container_name)
+    container = driver.get_container(container_name=container_name)
 
-        StorageManager.add_storage(container_name, container)
+    StorageManager.add_storage(container_name, container)
 
 
 class Thumbnail(BaseModel):
@@ -104,7 +104,7 @@ class TitleBase(SQLModel):
     code: str | None = Field(index=True, nullable=True)
     year: int | None = None
     pages: int | None = None
-    author_id: int = Field(foreign_key="authors.id")
+    author_id: int = Field(foreign_key="authors.id", index=True)
     # logo: ImageType = Field(default=None, sa_column=Column(ImageType(storage=storage)))
 
 class Title(DBModelBase, TitleBase, table=True):
@@ -140,6 +140,7 @@ class Title(DBModelBase, TitleBase, table=True):
 
 
 class TitleOut(TitleBase):
+    id: int
     logo: ImageInfo | None = None
 
 
@@ -151,7 +152,7 @@ def title_form(
 
 
 class  TitlePlateBase(SQLModel):
-    title_id: int = Field(foreign_key="titles.id", nullable=False)
+    title_id: int = Field(foreign_key="titles.id", nullable=False, index=True)
     plate: int
     position: int = Field(default=1)
 
@@ -186,8 +187,8 @@ class Source(DBModelBase, SourceBase, table=True):
         )
 
 class FileBase(SQLModel):
-    title_id: int = Field(foreign_key="titles.id")
-    source_id: int = Field(foreign_key="sources.id")
+    title_id: int = Field(foreign_key="titles.id", index=True)
+    source_id: int = Field(foreign_key="sources.id", index=True)
     # file: FileType = Field(sa_column=Column(FileType(storage=storage)))
     url: str | None = None
 
@@ -219,4 +220,72 @@ class File(DBModelBase, FileBase, table=True):
 
 
 class FileOut(FileBase):
-    file: ImageInfo | None = None
+    id: int
+    file: FileInfo | None = None
+
+
+class StorageObjectBase(SQLModel):
+    path: str = Field(index=True, unique=True)
+    size: int | None = Field(default=None, sa_type=BigInteger)
+    mtime_ns: int | None = Field(default=None, sa_type=BigInteger)
+    checksum: str | None = None
+    status: str = Field(default="ok", index=True)
+    verified_at: datetime | None = Field(default=None, index=True)
+
+
+class StorageObject(DBModelBase, StorageObjectBase, table=True):
+    def __str__(self):
+        return (
+            f"{self.__class__.__name__}(id={self.id}, "
+            f"path={self.path!r}, "
+            f"status={self.status!r})"
+        )
+
+
+class ScrubRunBase(SQLModel):
+    full: bool = False
+    objects: int = 0
+    hashed: int = 0
+    missing: int = 0
+    corrupt: int = 0
+    orphaned: int = 0
+
+
+class ScrubRun(DBModelBase, ScrubRunBase, table=True):
+    def __str__(self):
+        return (
+            f"{self.__class__.__name__}(id={self.id}, "
+            f"created_at={self.created_at!r})"
+        )
+
+
+class ProfileBase(SQLModel):
+    method: str
+    path: str = Field(index=True)
+    status_code: int
+    duration_ms: float
+    html: str = Field(sa_type=Text)
+
+
+class Profile(DBModelBase, ProfileBase, table=True):
+    def __str__(self):
+        return (
+            f"{self.__class__.__name__}(id={self.id}, "
+            f"path={self.path!r}, "
+            f"duration_ms={self.duration_ms!r})"
+        )
+
+
+class SlowQueryBase(SQLModel):
+    statement: str = Field(sa_type=Text)
+    parameters: str | None = Field(default=None, sa_type=Text)
+    duration_ms: float
+    plan: str = Field(sa_type=Text)
+
+
+class SlowQuery(DBModelBase, SlowQueryBase, table=True):
+    def __str__(self):
+        return (
+            f"{self.__class__.__name__}(id={self.id}, "
+            f"duration_ms={self.duration_ms!r})"
+        )
@@ -0,0 +1,223 @@
+"""Opt-in request profiling and slow-query capture.
+
+A request is profiled with pyinstrument (a sampling profiler, so the cost
+is bounded by ``PROFILE_INTERVAL`` rather than by the amount of Python
+executed) when it carries ``X-Profile: <PROFILE_TOKEN>`` or the
+``profile`` cookie set from the Profiling page of the admin. The HTML
+timeline is stored in ``profiles``.
+
+Independently, once ``SLOW_QUERY_MS`` is set (e.g. ``SLOW_QUERY_MS=500``
+in ``.env``), any SELECT slower than that is re-run in the background
+under ``EXPLAIN (ANALYZE, BUFFERS)`` and the plan stored in
+``slowquerys``. This executes the query a second time, so it is off by
+default. Both are browsable from the admin.
+"""
+
+import asyncio
+import hmac
+import logging
+import re
+import time
+
+from sqlalchemy import event
+
+from app.config import settings
+from app.db import SessionLocal, engine
+from app.models import Profile, SlowQuery
+
+logger = logging.getLogger(__name__)
+
+COOKIE_NAME = "profile"
+WRITES = re.compile(r"\b(INSERT|UPDATE|DELETE|MERGE|INTO|SHARE)\b", re.IGNORECASE)
+SKIP = "skip_slow_query_log"
+
+_queue: asyncio.Queue | None = None
+_worker: asyncio.Task | None = None
+_tasks: set[asyncio.Task] = set()
+# statement -> time of the last EXPLAIN, so a hot slow query is analysed
+# once per SLOW_QUERY_COOLDOWN instead of on every execution.
+_explained: dict[str, float] = {}
+
+
+def is_enabled() -> bool:
+    return bool(settings.PROFILE_TOKEN)
+
+
+def wants_profile(headers: dict[bytes, bytes], cookies: dict[str, str]) -> bool:
+    if not is_enabled():
+        return False
+    # Compared as bytes: header and cookie values may be any octets, and
+    # compare_digest() rejects non-ASCII str.
+    token = headers.get(b"x-profile") or cookies.get(COOKIE_NAME, "").encode("latin-1")
+    return hmac.compare_digest(token, settings.PROFILE_TOKEN.encode())
+
+
+def parse_cookies(header: bytes) -> dict[str, str]:
+    cookies = {}
+    for part in header.decode("latin-1").split(";"):
+        name, _, value = part.strip().partition("=")
+        cookies[name] = value
+    return cookies
+
+
+def spawn(coro) -> None:
+    task = asyncio.create_task(coro)
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+
+
+async def save(obj) -> None:
+    try:
+        async with SessionLocal() as session:
+            session.add(obj)
+            await session.commit()
+    except Exception:
+        logger.exception("Failed to store %s", obj.__class__.__name__)
+
+
+async def save_profile(profiler, **fields) -> None:
+    try:
+        # Rendering the timeline of a long request takes a while.
+        html = await asyncio.to_thread(profiler.output_html)
+    except Exception:
+        logger.exception("Failed to render profile")
+        return
+    await save(Profile(html=html, **fields))
+
+
+class ProfilingMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not is_enabled():
+            return await self.app(scope, receive, send)
+        headers = dict(scope["headers"])
+        if not wants_profile(headers, parse_cookies(headers.get(b"cookie", b""))):
+            return await self.app(scope, receive, send)
+
+        from pyinstrument import Profiler
+
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        profiler = Profiler(interval=settings.PROFILE_INTERVAL, async_mode="enabled")
+        started = time.perf_counter()
+        profiler.start()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            profiler.stop()
+            duration = time.perf_counter() - started
+            path = scope["path"]
+            if scope.get("query_string"):
+                path = f"{path}?{scope['query_string'].decode('latin-1')}"
+            spawn(
+                save_profile(
+                    profiler,
+                    method=scope["method"],
+                    path=path,
+                    status_code=status_code,
+                    duration_ms=duration * 1000,
+                )
+            )
+
+
+def is_read_only(statement: str) -> bool:
+    """Whether ``statement`` is safe to re-run under EXPLAIN ANALYZE.
+
+    A plain SELECT or WITH query, but not one with a data-modifying CTE, a
+    SELECT INTO or a locking clause (FOR UPDATE/SHARE): the rollback would
+    undo the writes, but the row locks would still be held for the length
+    of the EXPLAIN. Errs on the side of skipping.
+    """
+    return statement.lstrip().upper().startswith(("SELECT", "WITH")) and not WRITES.search(
+        statement
+    )
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context._query_start = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    duration = time.perf_counter() - context._query_start
+    if (
+        _queue is None
+        or executemany
+        or duration * 1000 < settings.SLOW_QUERY_MS
+        or conn.info.get(SKIP)
+        or not is_read_only(statement)
+    ):
+        return
+    now = time.monotonic()
+    if now - _explained.get(statement, -settings.SLOW_QUERY_COOLDOWN) < settings.SLOW_QUERY_COOLDOWN:
+        return
+    if len(_explained) >= 1000:
+        _explained.clear()
+    _explained[statement] = now
+    try:
+        _queue.put_nowait((statement, parameters, duration))
+    except asyncio.QueueFull:
+        pass
+
+
+async def explain(statement: str, parameters, duration: float) -> None:
+    try:
+        async with engine.connect() as conn:
+            conn.info[SKIP] = True
+            try:
+                # ANALYZE executes the statement again; bound it and never commit.
+                await conn.exec_driver_sql(
+                    f"SET LOCAL statement_timeout = {int(settings.SLOW_QUERY_EXPLAIN_TIMEOUT_MS)}"
+                )
+                result = await conn.exec_driver_sql(
+                    f"EXPLAIN (ANALYZE, BUFFERS) {statement}", parameters
+                )
+                plan = "\n".join(row[0] for row in result)
+            finally:
+                conn.info.pop(SKIP, None)
+                await conn.rollback()
+    except Exception as exc:
+        plan = f"EXPLAIN failed: {exc}"
+    await save(
+        SlowQuery(
+            statement=statement,
+            parameters=repr(parameters),
+            duration_ms=duration * 1000,
+            plan=plan,
+        )
+    )
+
+
+async def explain_worker() -> None:
+    while True:
+        statement, parameters, duration = await _queue.get()
+        await explain(statement, parameters, duration)
+
+
+async def startup() -> None:
+    global _queue, _worker
+    if not settings.SLOW_QUERY_MS:
+        return
+    _queue = asyncio.Queue(maxsize=100)
+    event.listen(engine.sync_engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine.sync_engine, "after_cursor_execute", _after_cursor_execute)
+    _worker = asyncio.create_task(explain_worker())
+
+
+async def shutdown() -> None:
+    global _queue, _worker
+    if _worker is None:
+        return
+    event.remove(engine.sync_engine, "before_cursor_execute", _before_cursor_execute)
+    event.remove(engine.sync_engine, "after_cursor_execute", _after_cursor_execute)
+    _worker.cancel()
+    _queue, _worker = None, None
+    if _tasks:
+        await asyncio.gather(*_tasks, return_exceptions=True)
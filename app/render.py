@@ -0,0 +1,77 @@
+import asyncio
+import inspect
+import logging
+
+from fastapi.responses import StreamingResponse
+from jinja2 import Environment, FileSystemLoader, select_autoescape
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+env = Environment(
+    loader=FileSystemLoader("templates"),
+    autoescape=select_autoescape(),
+    enable_async=True,
+)
+
+
+class TemplateStream:
+    """Render a template with ``generate_async()`` into a chunked response.
+
+    Output is buffered up to ``STREAM_BUFFER_SIZE`` and sent whenever the
+    buffer fills or a data source calls ``flush()`` before it waits on the
+    database, so the client gets everything rendered so far without the
+    response degenerating into one tiny chunk per template expression.
+    """
+
+    def __init__(self, name: str):
+        self.template = env.get_template(name)
+        self._buffer: list[str] = []
+        self._size = 0
+        # Small, so a slow client holds rendering back instead of memory.
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=2)
+
+    async def flush(self) -> None:
+        if self._buffer:
+            chunk = "".join(self._buffer)
+            self._buffer, self._size = [], 0
+            await self._queue.put(chunk)
+
+    async def _render(self, context: dict) -> None:
+        try:
+            async for chunk in self.template.generate_async(context):
+                self._buffer.append(chunk)
+                self._size += len(chunk)
+                if self._size >= settings.STREAM_BUFFER_SIZE:
+                    await self.flush()
+            await self.flush()
+        except Exception as exc:
+            await self._queue.put(exc)
+        else:
+            await self._queue.put(None)
+        finally:
+            # Also reached when the client goes away: close the data
+            # sources now rather than whenever they are garbage collected.
+            for value in context.values():
+                if inspect.isasyncgen(value):
+                    await value.aclose()
+
+    async def _body(self, context: dict):
+        task = asyncio.create_task(self._render(context))
+        try:
+            while (item := await self._queue.get()) is not None:
+                if isinstance(item, Exception):
+                    # Headers are already out, all we can do is cut the page short.
+                    logger.error("Error rendering %s", self.template.name, exc_info=item)
+                    return
+                yield item
+        finally:
+            task.cancel()
+
+    def response(self, context: dict) -> StreamingResponse:
+        return StreamingResponse(
+            self._body(context),
+            media_type="text/html",
+            headers={"X-Accel-Buffering": "no"},
+        )
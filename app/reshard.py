@@ -0,0 +1,155 @@
+"""Move stored objects into the hashed directory layout.
+
+Run with ``python -m app.reshard``. First, objects still at the top of the
+``logo``/``file`` containers are renamed into their shard directory (see
+``app.storage.shard``) by a pool of ``RESHARD_WORKERS`` threads. Then the
+physical ``url``s kept in ``Title.logo`` and ``File.file`` (and in their
+thumbnails) are rewritten in batches of ``--batch-size`` rows.
+
+Both steps only touch what is not migrated yet, so an interrupted run is
+resumed by running it again. The app resolves both layouts in the
+meantime. Stored ``container/file_id`` paths never change.
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from sqlalchemy import JSON, bindparam, func, select, update
+
+from app.config import settings
+from app.db import SessionLocal, engine
+from app.models import File, Title
+from app.scrub import CONTAINERS
+from app.storage import PART_SUFFIX, physical_path, sharded_path
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 500
+
+
+def flat_objects(container_path: str) -> list[str]:
+    with os.scandir(container_path) as entries:
+        return [
+            entry.name
+            for entry in entries
+            if entry.is_file(follow_symlinks=False) and not entry.name.endswith(PART_SUFFIX)
+        ]
+
+
+def move(container_path: str, name: str) -> bool:
+    source = os.path.join(container_path, name)
+    target = sharded_path(container_path, name)
+    if target == source:
+        return False
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    if os.path.exists(target):
+        logger.warning("Not moving %s, %s already exists", source, target)
+        return False
+    try:
+        # Same filesystem, so atomic: readers find the object at one place
+        # or the other, never neither.
+        os.rename(source, target)
+    except FileNotFoundError:
+        return False
+    return True
+
+
+def move_objects(pool: ThreadPoolExecutor, root: str) -> int:
+    moved = 0
+    for container in CONTAINERS:
+        container_path = os.path.join(root, container)
+        if not os.path.isdir(container_path):
+            continue
+        names = flat_objects(container_path)
+        logger.info("%s: %d objects to move", container, len(names))
+        done = 0
+        for start in range(0, len(names), BATCH_SIZE * 10):
+            batch = names[start : start + BATCH_SIZE * 10]
+            done += sum(pool.map(partial(move, container_path), batch, chunksize=64))
+            logger.info("%s: moved %d of %d", container, done, len(names))
+        moved += done
+    return moved
+
+
+def relocate(root: str, value: dict) -> dict | None:
+    """``value`` with its urls pointing at the objects' current location, or None if unchanged."""
+    new = dict(value)
+    new["url"] = physical_path(root, value["path"])
+    thumbnail = value.get("thumbnail")
+    if thumbnail and thumbnail.get("path"):
+        new["thumbnail"] = dict(thumbnail, url=physical_path(root, thumbnail["path"]))
+    return None if new == value else new
+
+
+async def rewrite_urls(
+    pool: ThreadPoolExecutor, root: str, model, name: str, batch_size: int
+) -> int:
+    table = model.__table__
+    loop = asyncio.get_running_loop()
+    # The value is written as plain JSON, not through the file field, and
+    # only if the row was not changed since it was read.
+    statement = (
+        update(table)
+        .where(table.c.id == bindparam("row_id"))
+        .where(table.c.updated_at.is_not_distinct_from(bindparam("row_updated_at")))
+        .values({name: bindparam("value", type_=JSON), "updated_at": func.now()})
+    )
+    last_id, rewritten = 0, 0
+    while True:
+        async with SessionLocal() as session:
+            rows = (
+                await session.execute(
+                    select(table.c.id, table.c.updated_at, table.c[name])
+                    .where(table.c.id > last_id, table.c[name].is_not(None))
+                    .order_by(table.c.id)
+                    .limit(batch_size)
+                )
+            ).all()
+            if not rows:
+                return rewritten
+            values = await asyncio.gather(
+                *(loop.run_in_executor(pool, relocate, root, dict(value)) for _, _, value in rows)
+            )
+            changes = [
+                {"row_id": id_, "row_updated_at": updated_at, "value": value}
+                for (id_, updated_at, _), value in zip(rows, values, strict=True)
+                if value is not None
+            ]
+            if changes:
+                await session.execute(statement, changes)
+                await session.commit()
+            rewritten += len(changes)
+            last_id = rows[-1][0]
+            logger.info("%s.%s: up to id %d, %d rewritten", table.name, name, last_id, rewritten)
+
+
+async def reshard(batch_size: int = BATCH_SIZE) -> None:
+    root = settings.STORAGE_PATH
+    loop = asyncio.get_running_loop()
+    with ThreadPoolExecutor(
+        max_workers=settings.RESHARD_WORKERS, thread_name_prefix="reshard"
+    ) as pool:
+        moved = await loop.run_in_executor(None, move_objects, pool, root)
+        rewritten = 0
+        for model, name in ((Title, "logo"), (File, "file")):
+            rewritten += await rewrite_urls(pool, root, model, name, batch_size)
+    await engine.dispose()
+    logger.info("Moved %d objects, rewrote %d urls", moved, rewritten)
+
+
+def main(argv: list[str]) -> int:
+    parser = argparse.ArgumentParser(prog="python -m app.reshard")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    args = parser.parse_args(argv)
+    asyncio.run(reshard(args.batch_size))
+    return 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main(sys.argv[1:]))
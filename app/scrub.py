@@ -0,0 +1,320 @@
+"""Storage integrity scrubber.
+
+Cross-checks the objects referenced by ``Title.logo`` and ``File.file``
+against the ``logo``/``file`` containers on disk and records a checksum and
+last-verified time per object in ``storageobjects``. Each run stats every
+object but only re-reads those that changed or were verified more than
+``SCRUB_MAX_AGE_DAYS`` ago, so a full pass over the store is spread across
+runs. Partial uploads (``*.part``) are not objects and are skipped; those
+untouched for longer than ``STORAGE_IO_TIMEOUT``, left behind by a worker
+killed mid-upload, are removed.
+
+Run once with ``python -m app.scrub``; the app also schedules it every
+``SCRUB_INTERVAL_HOURS`` (see ``schedule``). Completed runs are recorded
+in ``scrubruns``.
+"""
+
+import asyncio
+import hashlib
+import logging
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, func, text
+from sqlalchemy.dialects.postgresql import insert
+from sqlmodel import select
+
+from app.config import settings
+from app.db import SessionLocal, engine
+from app.models import File, ScrubRun, StorageObject, Title
+from app.storage import METADATA_SUFFIX, PART_SUFFIX, physical_path
+
+logger = logging.getLogger(__name__)
+
+CONTAINERS = ("logo", "file")
+CHUNK_SIZE = 1024 * 1024
+BATCH_SIZE = 500
+# Arbitrary constant identifying the scrubber's advisory lock.
+LOCK_ID = 0x5C2B
+POLL_SECONDS = 300
+
+
+def logical_path(root: str, full_path: str) -> str:
+    """``container/object`` for a file in either the flat or the sharded layout."""
+    container, *_, name = os.path.relpath(full_path, root).split(os.sep)
+    return f"{container}/{name}"
+
+
+def remove_stale_part(path: str, mtime: float) -> None:
+    # Writes are abandoned after STORAGE_IO_TIMEOUT, so a partial upload not
+    # written to for longer than that belongs to no live request.
+    if mtime >= time.time() - settings.STORAGE_IO_TIMEOUT:
+        return
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        return
+    logger.warning("Removed stale partial upload %s", path)
+
+
+def scan_dir(path: str) -> tuple[list[tuple[str, int, int]], list[str]]:
+    files, dirs = [], []
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                dirs.append(entry.path)
+            elif entry.is_file(follow_symlinks=False):
+                stat = entry.stat(follow_symlinks=False)
+                if entry.name.endswith(PART_SUFFIX):
+                    remove_stale_part(entry.path, stat.st_mtime)
+                else:
+                    files.append((entry.path, stat.st_size, stat.st_mtime_ns))
+    return files, dirs
+
+
+def walk(pool: ThreadPoolExecutor, root: str) -> dict[str, tuple[int, int]]:
+    """Stat every object in the containers, one directory per pool task.
+
+    Blocks until the whole tree is scanned, so it must not run in ``pool``
+    itself: with a single worker it would wait forever on its own tasks.
+    """
+    found = {}
+    pending = {
+        pool.submit(scan_dir, os.path.join(root, name))
+        for name in CONTAINERS
+        if os.path.isdir(os.path.join(root, name))
+    }
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            files, dirs = future.result()
+            for full_path, size, mtime_ns in files:
+                found[logical_path(root, full_path)] = (size, mtime_ns)
+            pending.update(pool.submit(scan_dir, path) for path in dirs)
+    return found
+
+
+def checksum(full_path: str) -> str:
+    digest = hashlib.sha256()
+    with open(full_path, "rb") as f:
+        while chunk := f.read(CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+async def referenced_paths(session) -> set[str]:
+    paths = set()
+    for column in (Title.logo, File.file):
+        result = await session.stream_scalars(
+            select(column).where(column.is_not(None)).execution_options(yield_per=1000)
+        )
+        async for value in result:
+            paths.update(value.get("files") or [value["path"]])
+    return paths
+
+
+async def known_objects(session) -> dict[str, StorageObject]:
+    result = await session.stream_scalars(
+        select(StorageObject).execution_options(yield_per=1000)
+    )
+    return {obj.path: obj async for obj in result}
+
+
+async def save(session, rows: list[dict]) -> None:
+    for start in range(0, len(rows), BATCH_SIZE):
+        statement = insert(StorageObject).values(rows[start : start + BATCH_SIZE])
+        statement = statement.on_conflict_do_update(
+            index_elements=[StorageObject.path],
+            set_={
+                name: statement.excluded[name]
+                for name in ("size", "mtime_ns", "checksum", "status", "verified_at")
+            }
+            | {"updated_at": statement.excluded.verified_at},
+        )
+        await session.execute(statement)
+        await session.commit()
+
+
+def is_orphaned(path: str, referenced: set[str]) -> bool:
+    if path.endswith(METADATA_SUFFIX):
+        return path[: -len(METADATA_SUFFIX)] not in referenced
+    return path not in referenced
+
+
+def hash_row(root: str, row: dict) -> None:
+    try:
+        digest = checksum(physical_path(root, row["path"]))
+    except FileNotFoundError:
+        row["status"] = "missing"
+    except OSError:
+        row["status"] = "corrupt"
+    else:
+        # Stored objects are written once, so any change to the bytes is
+        # damage; the original checksum is kept as the reference.
+        if row["checksum"] is not None and row["checksum"] != digest:
+            row["status"] = "corrupt"
+        else:
+            row["checksum"] = digest
+
+
+async def scrub(full: bool = False) -> dict[str, list[str]]:
+    """Run one pass and return the problem paths grouped by status."""
+    root = settings.STORAGE_PATH
+    now = datetime.utcnow()
+    stale_before = now - timedelta(days=settings.SCRUB_MAX_AGE_DAYS)
+    loop = asyncio.get_running_loop()
+
+    pool = ThreadPoolExecutor(max_workers=settings.SCRUB_WORKERS, thread_name_prefix="scrub")
+    try:
+        async with SessionLocal() as session:
+            walking = loop.run_in_executor(None, walk, pool, root)
+            referenced = await referenced_paths(session)
+            known = await known_objects(session)
+            on_disk = await walking
+
+            rows = [
+                {"path": path, "size": None, "mtime_ns": None, "status": "missing",
+                 "checksum": known[path].checksum if path in known else None,
+                 "verified_at": now}
+                for path in referenced - on_disk.keys()
+            ]
+            changed = [
+                row for row in rows
+                if row["path"] not in known or known[row["path"]].status != "missing"
+            ]
+
+            to_hash = []
+            for path, (size, mtime_ns) in on_disk.items():
+                obj = known.get(path)
+                row = {"path": path, "size": size, "mtime_ns": mtime_ns,
+                       "status": "orphaned" if is_orphaned(path, referenced) else "ok",
+                       "checksum": obj.checksum if obj else None, "verified_at": now}
+                if (
+                    full
+                    or obj is None
+                    or obj.checksum is None
+                    or obj.verified_at is None
+                    or obj.verified_at < stale_before
+                    or (obj.size, obj.mtime_ns) != (size, mtime_ns)
+                ):
+                    to_hash.append(row)
+                    continue
+                if obj.status == "corrupt":
+                    row["status"] = "corrupt"
+                row["verified_at"] = obj.verified_at
+                rows.append(row)
+                if row["status"] != obj.status:
+                    changed.append(row)
+            await save(session, changed)
+
+            gone = known.keys() - on_disk.keys() - referenced
+            if gone:
+                await session.execute(delete(StorageObject).where(StorageObject.path.in_(gone)))
+                await session.commit()
+
+            def last_verified(row: dict) -> datetime:
+                obj = known.get(row["path"])
+                return obj.verified_at if obj and obj.verified_at else datetime.min
+
+            # Oldest verifications first, committed per batch, so an interrupted
+            # run still moves the window forward.
+            to_hash.sort(key=last_verified)
+            for start in range(0, len(to_hash), BATCH_SIZE):
+                batch = to_hash[start : start + BATCH_SIZE]
+                await asyncio.gather(
+                    *(loop.run_in_executor(pool, hash_row, root, row) for row in batch)
+                )
+                await save(session, batch)
+            rows.extend(to_hash)
+    finally:
+        # When the run is cancelled, don't block the event loop on the
+        # hashes still running; those threads finish their file and exit.
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    report = {"missing": [], "corrupt": [], "orphaned": []}
+    for row in rows:
+        if row["status"] in report:
+            report[row["status"]].append(row["path"])
+    async with SessionLocal() as session:
+        session.add(
+            ScrubRun(
+                full=full,
+                objects=len(rows),
+                hashed=len(to_hash),
+                **{status: len(paths) for status, paths in report.items()},
+            )
+        )
+        await session.commit()
+    logger.info(
+        "Scrubbed %d objects (%d hashed): %s",
+        len(rows),
+        len(to_hash),
+        ", ".join(f"{len(paths)} {status}" for status, paths in report.items()),
+    )
+    return report
+
+
+async def last_run(conn) -> datetime | None:
+    return await conn.scalar(select(func.max(ScrubRun.created_at)))
+
+
+@asynccontextmanager
+async def exclusive(conn):
+    """Hold the scrubber's advisory lock on ``conn``; yields False if another process has it."""
+    locked = await conn.scalar(text("SELECT pg_try_advisory_lock(:id)"), {"id": LOCK_ID})
+    # Session-level lock: it outlives the transaction, which must not stay
+    # open for the length of the scrub.
+    await conn.commit()
+    if not locked:
+        yield False
+        return
+    try:
+        yield True
+    finally:
+        await conn.execute(text("SELECT pg_advisory_unlock(:id)"), {"id": LOCK_ID})
+        await conn.commit()
+
+
+async def schedule() -> None:
+    """Scrub every ``SCRUB_INTERVAL_HOURS``, once across all app workers.
+
+    Every worker polls; the one that gets the lock while the last recorded
+    run (scheduled or from the command line) is older than the interval
+    does the scrub. Worker restarts therefore neither skip nor repeat runs.
+    Set ``SCRUB_INTERVAL_HOURS=0`` to run ``python -m app.scrub`` from cron
+    or a systemd timer instead.
+    """
+    interval = timedelta(hours=settings.SCRUB_INTERVAL_HOURS)
+    while True:
+        await asyncio.sleep(POLL_SECONDS)
+        try:
+            async with engine.connect() as conn, exclusive(conn) as locked:
+                if not locked:
+                    continue
+                last = await last_run(conn)
+                await conn.commit()
+                if last is None or last < datetime.utcnow() - interval:
+                    await scrub()
+        except Exception:
+            logger.exception("Scheduled storage scrub failed")
+
+
+async def main(argv: list[str]) -> int:
+    async with engine.connect() as conn, exclusive(conn) as locked:
+        if not locked:
+            print("Another scrub is running", file=sys.stderr)
+            return 2
+        report = await scrub(full="--full" in argv)
+    for status, paths in report.items():
+        for path in sorted(paths):
+            print(f"{status}\t{path}")
+    return 1 if any(report.values()) else 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(asyncio.run(main(sys.argv[1:])))
@@ -0,0 +1,166 @@
+"""Fast JSON encoding for the read endpoints.
+
+``TitleOut`` and ``FileOut`` document the response shape, but validating
+every row into them and then dumping the models again is most of the cost
+of a large page. ``RowEncoder`` selects exactly the output columns and
+encodes the result tuples straight to JSON bytes with orjson; the data
+comes from our own tables, so there is nothing to validate.
+
+Encoded rows are kept in ``cache`` keyed by ``(table, id)`` and checked
+against ``updated_at``, so a page of hot titles is mostly a join of
+ready-made bytes. Commits through any session evict the rows they touched
+right away; rows changed by another worker are caught by ``updated_at``.
+
+That makes ``updated_at`` part of the contract: a write in raw SQL that
+leaves it alone (a hand-written migration, psql) is not seen by running
+workers until the row drops out of their LRU, so such writes must set
+``updated_at = now()`` or be followed by a restart of the app.
+``app.migrate.backfill`` and ``app.reshard`` do the former.
+"""
+
+from collections import OrderedDict
+
+import orjson
+from fastapi import Response
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session
+
+from app.config import settings
+
+DIRTY = "serializers_dirty"
+
+
+class JSONResponse(Response):
+    """JSON response that passes pre-encoded bytes through untouched."""
+
+    media_type = "application/json"
+
+    def render(self, content) -> bytes:
+        if isinstance(content, bytes):
+            return content
+        return orjson.dumps(content)
+
+
+def file_info(value) -> dict | None:
+    """Project a stored sqlalchemy_file value onto ``FileInfo``/``ImageInfo``."""
+    if value is None:
+        return None
+    info = {
+        "filename": value.get("filename"),
+        "content_type": value.get("content_type"),
+        "path": value.get("path"),
+        "url": value.get("url"),
+    }
+    if "thumbnail" in value:
+        thumbnail = value["thumbnail"]
+        info["thumbnail"] = {"path": thumbnail.get("path"), "url": thumbnail.get("url")}
+    return info
+
+
+class RowEncoder:
+    """Encode rows of ``model`` in the shape of the response model ``out``."""
+
+    def __init__(self, model, out, converters: dict | None = None):
+        self.table = model.__table__
+        self.fields = tuple(out.model_fields)
+        self.columns = [self.table.c[name] for name in self.fields]
+        self.converters = [
+            (self.fields.index(name), convert) for name, convert in (converters or {}).items()
+        ]
+
+    def encode(self, values) -> bytes:
+        if self.converters:
+            values = list(values)
+            for i, convert in self.converters:
+                values[i] = convert(values[i])
+        return orjson.dumps(dict(zip(self.fields, values, strict=True)))
+
+
+class FragmentCache:
+    """LRU of encoded rows, each stored with the ``updated_at`` it was encoded at."""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: OrderedDict[tuple, tuple] = OrderedDict()
+
+    def get(self, key: tuple, version) -> bytes | None:
+        entry = self._entries.get(key)
+        if entry is None or entry[0] != version:
+            return None
+        self._entries.move_to_end(key)
+        return entry[1]
+
+    def put(self, key: tuple, version, data: bytes) -> None:
+        if not self.max_entries:
+            return
+        self._entries[key] = (version, data)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, keys) -> None:
+        for key in keys:
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+
+cache = FragmentCache(settings.JSON_CACHE_SIZE)
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_dirty(session, flush_context):
+    # new/dirty/deleted still describe the flushed objects at this point.
+    dirty = session.info.setdefault(DIRTY, set())
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        table = getattr(obj, "__table__", None)
+        if table is not None and getattr(obj, "id", None) is not None:
+            dirty.add((table.name, obj.id))
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate(session):
+    cache.invalidate(session.info.pop(DIRTY, ()))
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard(session):
+    session.info.pop(DIRTY, None)
+
+
+async def encode_rows(session, encoder: RowEncoder, where=(), limit: int | None = None) -> bytes:
+    """Encode the rows matching ``where`` ordered by id as a JSON array.
+
+    Only ``id`` and ``updated_at`` are read for rows whose encoding is
+    cached and current; the full columns are fetched for the rest.
+    """
+    table = encoder.table
+    if not cache.max_entries:
+        result = await session.execute(
+            select(*encoder.columns).where(*where).order_by(table.c.id).limit(limit)
+        )
+        return b"[" + b",".join(encoder.encode(row) for row in result) + b"]"
+
+    versions = (
+        await session.execute(
+            select(table.c.id, table.c.updated_at).where(*where).order_by(table.c.id).limit(limit)
+        )
+    ).all()
+    fragments = {}
+    missing = []
+    for id_, updated_at in versions:
+        data = cache.get((table.name, id_), updated_at)
+        if data is None:
+            missing.append(id_)
+        else:
+            fragments[id_] = data
+    if missing:
+        result = await session.execute(
+            select(table.c.id, table.c.updated_at, *encoder.columns).where(table.c.id.in_(missing))
+        )
+        for id_, updated_at, *values in result:
+            fragments[id_] = data = encoder.encode(values)
+            cache.put((table.name, id_), updated_at, data)
+    # A row deleted between the two queries is simply left out.
+    return b"[" + b",".join(fragments[id_] for id_, _ in versions if id_ in fragments) + b"]"
@@ -0,0 +1,243 @@
+"""Local storage driver that keeps file I/O off the event loop.
+
+sqlalchemy_file's ``StorageManager`` calls the libcloud driver synchronously
+from flush and commit events. Under an ``AsyncSession`` those events run in
+SQLAlchemy's greenlet on the event loop thread, so with the stock ``LOCAL``
+driver a slow NFS write stalls every request on the worker.
+
+``AsyncLocalStorageDriver`` keeps the driver contract but runs the
+filesystem work in a bounded thread pool and suspends the calling greenlet
+with ``await_only()`` until it finishes, bounded by ``STORAGE_IO_TIMEOUT``.
+Outside a greenlet (scripts, migrations) it behaves like the stock driver.
+
+Objects are also fanned out into hashed subdirectories
+(``logo/3f/a2/<file_id>``, ``STORAGE_SHARD_DEPTH`` levels) so no directory
+grows to hundreds of thousands of entries. Object names, and so the
+``container/file_id`` paths sqlalchemy_file stores, do not change; only
+where the file sits on disk does. ``locate()`` falls back to the flat
+layout, so objects not yet moved by ``app.reshard`` keep resolving.
+"""
+
+import asyncio
+import hashlib
+import os
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from libcloud.storage.base import Object
+from libcloud.storage.drivers.local import LocalStorageDriver
+from libcloud.storage.types import ObjectDoesNotExistError, ObjectError
+from sqlalchemy.util.concurrency import await_only, in_greenlet
+from starlette.staticfiles import StaticFiles
+
+from app.config import settings
+
+CHUNK_SIZE = 1024 * 1024
+METADATA_SUFFIX = ".metadata.json"
+# Objects are written as ``<object>.<uuid>.part`` and renamed into place.
+PART_SUFFIX = ".part"
+
+_executor: ThreadPoolExecutor | None = None
+
+
+async def startup() -> None:
+    global _executor
+    _executor = ThreadPoolExecutor(
+        max_workers=settings.STORAGE_IO_WORKERS, thread_name_prefix="storage"
+    )
+
+
+async def shutdown() -> None:
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=True)
+        _executor = None
+
+
+def read_chunks(source, chunk_size: int = CHUNK_SIZE):
+    # Iterating a binary file yields lines, which for an upload without
+    # newlines means the whole file in one piece.
+    if hasattr(source, "read"):
+        while chunk := source.read(chunk_size):
+            yield chunk
+    else:
+        yield from source
+
+
+def shard(object_name: str) -> str:
+    """Hashed subdirectory of an object, e.g. ``3f/a2``.
+
+    A ``.metadata.json`` sidecar hashes like its object, so the two stay in
+    the same directory.
+    """
+    name = object_name.removesuffix(METADATA_SUFFIX)
+    digest = hashlib.md5(name.encode(), usedforsecurity=False).hexdigest()
+    return "/".join(digest[2 * i : 2 * i + 2] for i in range(settings.STORAGE_SHARD_DEPTH))
+
+
+def sharded_path(container_path: str, object_name: str) -> str:
+    return os.path.join(container_path, shard(object_name), object_name)
+
+
+def locate(container_path: str, object_name: str) -> str:
+    """Where an object is on disk: sharded, or flat if not migrated yet."""
+    path = sharded_path(container_path, object_name)
+    if not os.path.exists(path):
+        flat_path = os.path.join(container_path, object_name)
+        if os.path.exists(flat_path):
+            return flat_path
+    return path
+
+
+def physical_path(root: str, path: str) -> str:
+    """Map a stored ``container/object`` path under ``root`` to the file on disk."""
+    container, _, object_name = path.partition("/")
+    if container and object_name and "/" not in object_name:
+        return locate(os.path.join(root, container), object_name)
+    return os.path.join(root, path)
+
+
+class StorageFiles(StaticFiles):
+    """``StaticFiles`` over the store that serves objects from either layout."""
+
+    def lookup_path(self, path: str):
+        root = str(self.directory)
+        return super().lookup_path(os.path.relpath(physical_path(root, path), root))
+
+
+async def _offload(fn, args, cancelled: threading.Event | None):
+    future = asyncio.get_running_loop().run_in_executor(_executor, fn, *args)
+    try:
+        return await asyncio.wait_for(asyncio.shield(future), settings.STORAGE_IO_TIMEOUT)
+    except asyncio.TimeoutError:
+        # The thread cannot be interrupted; writes stop at the next chunk.
+        if cancelled is not None:
+            cancelled.set()
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        raise TimeoutError(f"Storage I/O did not finish in {settings.STORAGE_IO_TIMEOUT}s")
+
+
+async def offload(fn, *args):
+    """Await ``fn(*args)`` in the pool from async code, e.g. a route."""
+    return await _offload(fn, args, None)
+
+
+def run(fn, *args, cancelled: threading.Event | None = None):
+    """Call ``fn(*args)`` in the pool if the caller can wait for it there."""
+    if _executor is None or not in_greenlet():
+        return fn(*args)
+    return await_only(_offload(fn, args, cancelled))
+
+
+class AsyncLocalStorageDriver(LocalStorageDriver):
+    # sqlalchemy_file keys its local-storage metadata handling off this name.
+    name = LocalStorageDriver.name
+
+    def _write(self, chunks, obj_path: str, cancelled: threading.Event) -> None:
+        self._make_path(os.path.dirname(obj_path))
+        # Written under a temporary name and renamed into place, so readers
+        # never see a partial object and no lock is needed.
+        tmp_path = f"{obj_path}.{uuid.uuid4().hex}{PART_SUFFIX}"
+        try:
+            with open(tmp_path, "wb") as f:
+                for chunk in chunks:
+                    if cancelled.is_set():
+                        raise TimeoutError(f"Write to {obj_path} cancelled")
+                    f.write(chunk)
+            os.chmod(tmp_path, 0o664)
+            os.replace(tmp_path, obj_path)
+        except BaseException:
+            try:
+                os.unlink(tmp_path)
+            except FileNotFoundError:
+                pass
+            raise
+
+    def _object_path(self, container_name: str, object_name: str) -> str:
+        return locate(os.path.join(self.base_path, container_name), object_name)
+
+    def _make_object(self, container, object_name):
+        full_path = self._object_path(container.name, object_name)
+        if os.path.isdir(full_path):
+            raise ObjectError(value=None, driver=self, object_name=object_name)
+        try:
+            stat = os.stat(full_path)
+        except OSError:
+            raise ObjectDoesNotExistError(value=None, driver=self, object_name=object_name)
+
+        data_hash = self._get_hash_function()
+        data_hash.update(str(stat.st_mtime).encode("ascii"))
+        return Object(
+            name=object_name,
+            size=stat.st_size,
+            extra={
+                "creation_time": stat.st_ctime,
+                "access_time": stat.st_atime,
+                "modify_time": stat.st_mtime,
+            },
+            driver=self,
+            container=container,
+            hash=data_hash.hexdigest(),
+            meta_data=None,
+        )
+
+    def _get_objects(self, container):
+        cpath = self.get_container_cdn_url(container, check=True)
+        for _, _, files in os.walk(cpath):
+            for name in files:
+                if not name.endswith(PART_SUFFIX):
+                    yield self._make_object(container, name)
+
+    def get_object_cdn_url(self, obj):
+        return self._object_path(obj.container.name, obj.name)
+
+    def _upload(self, source, container, object_name, cancelled):
+        path = sharded_path(self.get_container_cdn_url(container, check=True), object_name)
+        if isinstance(source, str):
+            with open(source, "rb") as f:
+                self._write(read_chunks(f), path, cancelled)
+        else:
+            self._write(read_chunks(source), path, cancelled)
+        return self._make_object(container, object_name)
+
+    def upload_object(
+        self, file_path, container, object_name, extra=None, verify_hash=True, headers=None
+    ):
+        cancelled = threading.Event()
+        return run(self._upload, file_path, container, object_name, cancelled, cancelled=cancelled)
+
+    def upload_object_via_stream(self, iterator, container, object_name, extra=None, headers=None):
+        cancelled = threading.Event()
+        return run(self._upload, iterator, container, object_name, cancelled, cancelled=cancelled)
+
+    def get_object(self, container_name, object_name):
+        return run(super().get_object, container_name, object_name)
+
+    def _delete(self, obj) -> bool:
+        # Unlike the stock driver, empty parent directories are kept: pruning
+        # a shard directory races with an upload into it (between _make_path
+        # and open), and there are at most 256**STORAGE_SHARD_DEPTH of them.
+        try:
+            os.unlink(self.get_object_cdn_url(obj))
+        except OSError:
+            return False
+        return True
+
+    def delete_object(self, obj):
+        return run(self._delete, obj)
+
+    def download_object(
+        self, obj, destination_path, overwrite_existing=False, delete_on_failure=True
+    ):
+        return run(
+            super().download_object, obj, destination_path, overwrite_existing, delete_on_failure
+        )
+
+    def download_object_as_stream(self, obj, chunk_size=None):
+        f = run(open, self.get_object_cdn_url(obj), "rb")
+        try:
+            while chunk := run(f.read, chunk_size or CHUNK_SIZE):
+                yield chunk
+        finally:
+            f.close()
@@ -0,0 +1,107 @@
+"""Compare JSON encoding paths for a page of ``TitleOut`` rows.
+
+    python -m benchmarks.serialize [rows] [repeat]
+
+No database is needed: rows are synthetic tuples shaped like the result
+of ``select(*TITLE_OUT.columns)``, including a stored logo.
+"""
+
+import json
+import sys
+import timeit
+from datetime import datetime
+
+from fastapi.encoders import jsonable_encoder
+from pydantic import TypeAdapter
+
+from app.api import TITLE_OUT
+from app.models import TitleOut
+from app.serializers import FragmentCache
+
+
+def logo(i: int) -> dict:
+    return {
+        "file_id": f"{i:032x}",
+        "upload_storage": "logo",
+        "filename": f"cover-{i}.jpg",
+        "content_type": "image/jpeg",
+        "size": 183_245,
+        "path": f"logo/{i:032x}",
+        "url": f"/nfs/dvr/plates/logo/{i:032x}",
+        "saved": True,
+        "uploaded_at": datetime(2024, 5, 1).isoformat(),
+        "files": [f"logo/{i:032x}", f"logo/{i:032x}-thumb"],
+        "thumbnail": {
+            "file_id": f"{i:032x}-thumb",
+            "width": 300,
+            "height": 430,
+            "path": f"logo/{i:032x}-thumb",
+            "url": f"/nfs/dvr/plates/logo/{i:032x}-thumb",
+        },
+    }
+
+
+def make_rows(count: int) -> list[tuple]:
+    values = {
+        "id": 0,
+        "name": "",
+        "code": None,
+        "year": 1987,
+        "pages": 48,
+        "author_id": 7,
+        "logo": None,
+    }
+    rows = []
+    for i in range(1, count + 1):
+        values.update(id=i, name=f"Title {i}", code=f"T-{i:05d}", logo=logo(i) if i % 4 else None)
+        rows.append(tuple(values[name] for name in TITLE_OUT.fields))
+    return rows
+
+
+def main() -> None:
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    rows = make_rows(count)
+    dicts = [dict(zip(TITLE_OUT.fields, row, strict=True)) for row in rows]
+    adapter = TypeAdapter(list[TitleOut])
+    cache = FragmentCache(count)
+
+    def fastapi_default():
+        # What FastAPI does for a plain return value with response_model set.
+        models = [TitleOut.model_validate(d) for d in dicts]
+        return json.dumps(jsonable_encoder(models)).encode()
+
+    def pydantic_adapter():
+        return adapter.dump_json(adapter.validate_python(dicts))
+
+    def row_encoder():
+        return b"[" + b",".join(TITLE_OUT.encode(row) for row in rows) + b"]"
+
+    def row_encoder_cached():
+        parts = []
+        for row in rows:
+            data = cache.get(("titles", row[0]), None)
+            if data is None:
+                data = TITLE_OUT.encode(row)
+                cache.put(("titles", row[0]), None, data)
+            parts.append(data)
+        return b"[" + b",".join(parts) + b"]"
+
+    assert json.loads(fastapi_default()) == json.loads(row_encoder())
+    assert json.loads(pydantic_adapter()) == json.loads(row_encoder_cached())
+
+    print(f"{count} rows, best of 5 x {repeat}")
+    baseline = None
+    for name, fn in (
+        ("fastapi default", fastapi_default),
+        ("pydantic adapter", pydantic_adapter),
+        ("row encoder", row_encoder),
+        ("row encoder, cached", row_encoder_cached),
+    ):
+        best = min(timeit.repeat(fn, number=repeat, repeat=5)) / repeat
+        baseline = baseline or best
+        print(f"  {name:<22}{best * 1000:8.3f} ms/page  {baseline / best:6.1f}x")
+
+
+if __name__ == "__main__":
+    main()
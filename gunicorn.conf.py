@@ -0,0 +1,33 @@
+# Production server settings, used by `make serve`.
+#
+# The app is imported once in the master (preload_app) and forked into one
+# uvicorn worker per CPU. Per-process resources (database pool, thread
+# pools, background tasks) are created in main.lifespan after the fork.
+import os
+
+from app.config import settings
+
+
+def cpu_count() -> int:
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+bind = settings.BIND
+workers = settings.WORKERS or cpu_count()
+worker_class = "uvicorn_worker.UvicornWorker"
+preload_app = True
+
+# Recycle workers to contain slow memory growth; the jitter keeps them from
+# all restarting at once.
+max_requests = settings.MAX_REQUESTS
+max_requests_jitter = settings.MAX_REQUESTS // 10
+
+# On SIGTERM/restart, workers stop accepting and get this long to finish
+# in-flight requests before being killed.
+graceful_timeout = settings.GRACEFUL_TIMEOUT
+timeout = 60
+keepalive = 5
+
+accesslog = "-"
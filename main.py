@@ -1,25 +1,55 @@
-from contextlib import asynccontextmanager
+import asyncio
+from contextlib import asynccontextmanager, suppress
 
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, RedirectResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from fastapi_async_sqlalchemy import SQLAlchemyMiddleware, db
+from sqlalchemy.orm import noload, selectinload
 from sqlmodel import select
-from sqladmin import Admin, ModelView
-from sqlalchemy.pool import AsyncAdaptedQueuePool, NullPool
-
-from app.config import ModeEnum, settings
-from app.db import engine
-from app.models import Author, File, Source, Title, TitlePlate
+from markupsafe import Markup
+from sqladmin import Admin, BaseView, ModelView, expose
+
+from app import admission, api, images, profiling, scrub, storage
+from app.config import settings
+from app.db import SessionLocal, engine
+from app.models import (
+    Author,
+    File,
+    Profile,
+    SlowQuery,
+    Source,
+    StorageObject,
+    Title,
+    TitlePlate,
+)
+from app.render import TemplateStream
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    # startup
+    # startup, once per worker process. With preload_app the module was
+    # imported in the gunicorn master, so drop any pool state inherited
+    # through fork without touching the parent's connections.
+    await engine.dispose(close=False)
+    await storage.startup()
+    await images.startup()
+    await profiling.startup()
+    scrubber = None
+    if settings.SCRUB_INTERVAL_HOURS:
+        scrubber = asyncio.create_task(scrub.schedule())
     yield
-    # shutdown
+    # shutdown, after the server has drained in-flight requests
+    if scrubber is not None:
+        scrubber.cancel()
+        with suppress(asyncio.CancelledError):
+            await scrubber
+    await profiling.shutdown()
+    await images.shutdown()
+    await storage.shutdown()
+    await engine.dispose()
 
 
 app = FastAPI(
@@ -29,19 +59,9 @@ app = FastAPI(
     lifespan=lifespan,
 )
 
-app.add_middleware(
-    SQLAlchemyMiddleware,
-    db_url=str(settings.ASYNC_DATABASE_URI),
-    engine_args={
-        "echo": False,
-        "poolclass": (
-            NullPool if settings.MODE == ModeEnum.testing else AsyncAdaptedQueuePool
-        ),
-        # "pool_pre_ping": True,
-        # "pool_size": settings.POOL_SIZE,
-        # "max_overflow": 64,
-    },
-)
+app.add_middleware(SQLAlchemyMiddleware, custom_engine=engine)
+app.add_middleware(profiling.ProfilingMiddleware)
+app.add_middleware(admission.AdmissionMiddleware)
 
 
 if settings.BACKEND_CORS_ORIGINS:
@@ -57,7 +77,9 @@ if settings.BACKEND_CORS_ORIGINS:
 admin = Admin(app, engine)
 
 app.mount("/static", StaticFiles(directory="static", html=True))
-app.mount("/plates", StaticFiles(directory="/nfs/dvr/plates"))
+app.mount("/plates", storage.StorageFiles(directory=settings.STORAGE_PATH))
+app.include_router(images.router)
+app.include_router(api.router)
 
 templates = Jinja2Templates(directory="templates")
 
@@ -149,8 +171,141 @@ class FileAdmin(ModelView, model=File):
 admin.add_view(FileAdmin)
 
 
+class StorageObjectAdmin(ModelView, model=StorageObject):
+    can_create = False
+    can_edit = False
+    column_list = [
+        StorageObject.id,
+        StorageObject.path,
+        StorageObject.status,
+        StorageObject.size,
+        StorageObject.verified_at,
+    ]
+    column_sortable_list = [StorageObject.path, StorageObject.status, StorageObject.verified_at]
+    column_searchable_list = [StorageObject.path, StorageObject.status]
+
+
+admin.add_view(StorageObjectAdmin)
+
+
+class ProfileAdmin(ModelView, model=Profile):
+    can_create = False
+    can_edit = False
+    column_list = [
+        Profile.id,
+        Profile.created_at,
+        Profile.method,
+        Profile.path,
+        Profile.status_code,
+        Profile.duration_ms,
+        "flame graph",
+    ]
+    column_details_exclude_list = [Profile.html]
+    column_sortable_list = [Profile.created_at, Profile.path, Profile.duration_ms]
+    column_searchable_list = [Profile.path]
+    column_default_sort = (Profile.created_at, True)
+    column_formatters = {
+        "flame graph": lambda m, a: Markup(
+            f'<a href="/admin/profiling/{m.id}" target="_blank">open</a>'
+        ),
+    }
+
+
+admin.add_view(ProfileAdmin)
+
+
+class SlowQueryAdmin(ModelView, model=SlowQuery):
+    can_create = False
+    can_edit = False
+    column_list = [SlowQuery.id, SlowQuery.created_at, SlowQuery.duration_ms, SlowQuery.statement]
+    column_sortable_list = [SlowQuery.created_at, SlowQuery.duration_ms]
+    column_searchable_list = [SlowQuery.statement]
+    column_default_sort = (SlowQuery.created_at, True)
+    column_formatters = {SlowQuery.statement: lambda m, a: m.statement[:120]}
+    column_formatters_detail = {
+        SlowQuery.plan: lambda m, a: Markup("<pre>{}</pre>").format(m.plan),
+    }
+
+
+admin.add_view(SlowQueryAdmin)
+
+
+class ProfilingAdmin(BaseView):
+    name = "Profiling"
+
+    @expose("/profiling", methods=["GET", "POST"])
+    async def profiling(self, request: Request):
+        if request.method == "POST":
+            response = RedirectResponse(request.url, status_code=303)
+            if request.cookies.get(profiling.COOKIE_NAME):
+                response.delete_cookie(profiling.COOKIE_NAME)
+            elif profiling.is_enabled():
+                response.set_cookie(
+                    profiling.COOKIE_NAME, settings.PROFILE_TOKEN, httponly=True, samesite="strict"
+                )
+            return response
+
+        return await self.templates.TemplateResponse(
+            request,
+            "profiling.html",
+            {
+                "title": "Profiling",
+                "enabled": profiling.is_enabled(),
+                "active": bool(request.cookies.get(profiling.COOKIE_NAME)),
+                "slow_query_ms": settings.SLOW_QUERY_MS,
+            },
+        )
+
+    @expose("/profiling/{id}", methods=["GET"])
+    async def show_profile(self, request: Request):
+        async with SessionLocal() as session:
+            profile = await session.get(Profile, int(request.path_params["id"]))
+        if profile is None:
+            return HTMLResponse("Profile not found", status_code=404)
+        return HTMLResponse(profile.html)
+
+
+admin.add_view(ProfilingAdmin)
+
+
+async def iter_titles(flush, batch_size: int = settings.STREAM_BATCH_SIZE):
+    """Yield titles in id order, one query per batch.
+
+    Each batch gets its own short session: the response body is produced
+    after the request session of SQLAlchemyMiddleware has been closed, and
+    no pooled connection should stay checked out while the page renders or
+    a slow client drains it.
+    """
+    statement = (
+        select(Title)
+        .order_by(Title.id)
+        .limit(batch_size)
+        .options(
+            selectinload(Title.author).noload(Author.titles),
+            selectinload(Title.plates).noload(TitlePlate.title),
+            noload(Title.files),
+        )
+    )
+    last_id = None
+    while True:
+        # Send what is rendered so far before waiting on the database.
+        await flush()
+        batch = statement if last_id is None else statement.where(Title.id > last_id)
+        async with SessionLocal() as session:
+            titles = (await session.execute(batch)).scalars().all()
+        for title in titles:
+            yield title
+        if len(titles) < batch_size:
+            return
+        last_id = titles[-1].id
+
+
 @app.get("/", response_class=HTMLResponse)
 async def index(request: Request):
+    if settings.STREAM_TEMPLATES:
+        stream = TemplateStream("index.html")
+        return stream.response({"request": request, "titles": iter_titles(stream.flush)})
+
     result = await db.session.execute(select(Title))
     titles = result.scalars().all()
     return templates.TemplateResponse("index.html", {"request": request, "titles": titles})